@@ -2,22 +2,53 @@ import asyncio
 import os
 import uuid
 import logging
-from flask import Flask, request, jsonify, session, send_from_directory, Response, stream_with_context
+import threading
+import time
+import queue
+import atexit
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import httpx
+from cachetools import TTLCache
+from flask import Flask, request, jsonify, session, send_from_directory, Response, stream_with_context, g
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from pikpakapi import PikPakApi
+from pikpakapi.PikpakException import PikpakException
 from dotenv import load_dotenv
 from database import db, User, Task 
 
 # Load environment variables
 load_dotenv()
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip for jsonify()
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.option), mimetype='application/json')
+
 app = Flask(__name__, static_folder='static', static_url_path='')
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'pikpak-downloader-secret')
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///pikpak.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 10, 'max_overflow': 20, 'pool_pre_ping': True}
 
 # Initialize extensions
 db.init_app(app)
@@ -27,53 +58,475 @@ login_manager.login_view = 'login'
 
 CORS(app, supports_credentials=True)
 
-# Global PikPak Client
-pikpak_client = None
+# Background event loop shared by every request so the PikPak client's
+# connection pool survives between calls
+_BG_LOOP = asyncio.new_event_loop()
+threading.Thread(target=_BG_LOOP.run_forever, name='pikpak-loop', daemon=True).start()
 
-def get_pikpak_client():
-    global pikpak_client
-    if pikpak_client is None:
+def run_async(coro):
+    """Run async function on the background loop and wait for the result"""
+    return asyncio.run_coroutine_threadsafe(coro, _BG_LOOP).result()
+
+async def gather(*coros):
+    """Await several PikPak calls concurrently (use through run_async)"""
+    return await asyncio.gather(*coros)
+
+# Shared HTTP/2 client so proxied downloads reuse (and multiplex over) CDN connections.
+# Bodies are relayed byte for byte, so ask the CDN not to compress them.
+_HTTP = httpx.Client(
+    http2=True,
+    follow_redirects=True,
+    headers={'Accept-Encoding': 'identity'},
+    timeout=httpx.Timeout(60, connect=5),
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60)
+)
+PROXY_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Large files are fetched as parallel Range segments to get past per-connection throttling
+PROXY_PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+PROXY_SEGMENT_SIZE = 8 * 1024 * 1024
+PROXY_SEGMENT_WORKERS = 4
+PROXY_SEGMENT_RETRIES = 3
+# Shared by all downloads; each download keeps at most PROXY_SEGMENT_WORKERS segments in flight
+_SEGMENT_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix='proxy-segment')
+
+# Places a download URL can appear in get_download_url's response, in order of preference
+_DOWNLOAD_URL_ACCESSORS = (
+    lambda d: d.get('web_content_link'),
+    lambda d: ((d.get('medias') or [{}])[0].get('link') or {}).get('url'),
+    lambda d: next(iter((d.get('links') or {}).values()), {}).get('url'),
+)
+
+def _fetch_segment(url, start, end):
+    # Retried because the headers and full Content-Length are already on their way to the client
+    for attempt in range(PROXY_SEGMENT_RETRIES):
+        try:
+            with _HTTP.stream('GET', url, headers={'Range': f'bytes={start}-{end}'}) as resp:
+                # Check before reading so a full-file 200 or an error body is never buffered
+                content_range = resp.headers.get('Content-Range', '')
+                if resp.status_code != 206 or not content_range.startswith(f'bytes {start}-{end}/'):
+                    raise IOError(f'Range request for bytes {start}-{end} failed with status '
+                                  f'{resp.status_code} ({content_range or "no Content-Range"})')
+                expected = end - start + 1
+                content = bytearray()
+                for chunk in resp.iter_raw():
+                    content += chunk
+                    if len(content) > expected:
+                        break
+            if len(content) != expected:
+                raise IOError(f'Range request for bytes {start}-{end} returned {len(content)} bytes')
+            return bytes(content)
+        except (httpx.HTTPError, IOError) as e:
+            if attempt == PROXY_SEGMENT_RETRIES - 1:
+                raise
+            logging.warning(f"Retrying bytes {start}-{end} after error: {e}")
+            time.sleep(0.5 * (attempt + 1))
+
+def _iter_segments(url, first, total):
+    """Yield the file in order: stream the first segment while the next ones download ahead"""
+    offsets = iter(range(PROXY_SEGMENT_SIZE, total, PROXY_SEGMENT_SIZE))
+    pending = deque()
+
+    def schedule_next():
+        start = next(offsets, None)
+        if start is not None:
+            end = min(start + PROXY_SEGMENT_SIZE, total) - 1
+            pending.append(_SEGMENT_EXECUTOR.submit(_fetch_segment, url, start, end))
+
+    try:
+        for _ in range(PROXY_SEGMENT_WORKERS):
+            schedule_next()
+        yield from first.iter_raw(PROXY_CHUNK_SIZE)
+        first.close()
+        # At most PROXY_SEGMENT_WORKERS segments are buffered at any time
+        while pending:
+            segment = pending.popleft().result()
+            schedule_next()
+            yield segment
+    finally:
+        first.close()
+        for future in pending:
+            future.cancel()
+
+# Pool of PikPak clients; each request uses the least busy one
+PIKPAK_POOL_SIZE = max(1, int(os.environ.get('PIKPAK_POOL_SIZE', '1')))
+pikpak_pool = []
+_inflight_lock = threading.Lock()
+
+class PooledClient:
+    """A logged-in PikPak client and the number of requests using it"""
+    __slots__ = ('api', 'inflight')
+
+    def __init__(self, api):
+        self.api = api
+        self.inflight = 0
+
+# PikPak `error` codes for a rejected session (error_code 16 is refreshed by pikpakapi itself)
+_AUTH_ERRORS = ('unauthenticated', 'invalid_grant')
+PIKPAK_TOKEN_REFRESH_INTERVAL = 30 * 60
+
+class PikpakAuthError(PikpakException):
+    """PikPak rejected the client's session"""
+
+def retry_on_auth_expiry(func):
+    """Log the client back in once and retry when PikPak rejects its session"""
+    @functools.wraps(func)
+    async def wrapper(client, method, url, *args, **kwargs):
+        token = client.access_token
+        try:
+            return await func(client, method, url, *args, **kwargs)
+        except PikpakAuthError as e:
+            # Sign-in endpoints themselves are never retried
+            if client.PIKPAK_USER_HOST in url:
+                raise
+            async with client.login_lock:
+                # Another request may have logged in while we waited
+                if client.access_token == token:
+                    logging.warning(f"PikPak session rejected ({e}), logging in again")
+                    await client.login()
+            return await func(client, method, url, *args, **kwargs)
+    return wrapper
+
+class PikPakClient(PikPakApi):
+    """PikPakApi that recovers from expired sessions by logging in again"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.login_lock = asyncio.Lock()
+
+    async def _handle_response(self, response):
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            data = {}
+        if data.get('error_code') != 16 and (response.status_code == 401 or data.get('error') in _AUTH_ERRORS):
+            raise PikpakAuthError(data.get('error_description') or data.get('error') or 'Unauthenticated')
+        return await super()._handle_response(response)
+
+    _make_request = retry_on_auth_expiry(PikPakApi._make_request)
+
+async def _create_client(username, password):
+    # Instantiated on the background loop so its HTTP client binds to it
+    return PikPakClient(username=username, password=password)
+
+async def _keep_tokens_fresh(clients):
+    """Refresh access tokens before they expire, logging in again if that fails"""
+    while True:
+        await asyncio.sleep(PIKPAK_TOKEN_REFRESH_INTERVAL)
+        for client in clients:
+            try:
+                async with client.login_lock:
+                    try:
+                        await client.refresh_access_token()
+                    except PikpakException:
+                        await client.login()
+            except Exception as e:
+                logging.error(f"Failed to refresh PikPak session: {e}")
+
+_pool_init_lock = threading.Lock()
+
+def _init_pikpak_pool():
+    global pikpak_pool
+    if pikpak_pool:
+        return pikpak_pool
+    with _pool_init_lock:
+        # Checked again so concurrent first requests only log in once
+        if pikpak_pool:
+            return pikpak_pool
         username = os.environ.get('PIKPAK_USERNAME')
         password = os.environ.get('PIKPAK_PASSWORD')
         if not username or not password:
             logging.error("PIKPAK_USERNAME and PIKPAK_PASSWORD must be set in env")
             return None
         try:
-            pikpak_client = PikPakApi(username=username, password=password)
-            run_async(pikpak_client.login())
-            logging.info("Logged in to PikPak successfully")
+            clients = [run_async(_create_client(username, password)) for _ in range(PIKPAK_POOL_SIZE)]
+            run_async(gather(*(c.login() for c in clients)))
+            asyncio.run_coroutine_threadsafe(_keep_tokens_fresh(clients), _BG_LOOP)
+            pikpak_pool = [PooledClient(c) for c in clients]
+            logging.info(f"Logged in to PikPak successfully ({len(clients)} client(s))")
         except Exception as e:
             logging.error(f"Failed to login to PikPak: {e}")
             return None
-    return pikpak_client
-
-def run_async(coro):
-    """Run async function in sync context"""
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    if loop.is_running():
-         # This handles the case where we might be inside another async loop (though Flask is typically sync)
-         # For simple scripts, creating a new loop is safer if not already in one.
-         # But `asyncio.run` is better for top-level. 
-         # Since we are in Flask (sync), `loop.run_until_complete` is standard.
-         pass
+    return pikpak_pool
 
-    return loop.run_until_complete(coro)
+def get_pikpak_client():
+    """Check out the least busy pooled client for the current request"""
+    if 'pikpak_client' in g:
+        return g.pikpak_client.api
+    pool = _init_pikpak_pool()
+    if not pool:
+        return None
+    with _inflight_lock:
+        pooled = min(pool, key=lambda c: c.inflight)
+        pooled.inflight += 1
+    g.pikpak_client = pooled
+    return pooled.api
+
+@app.teardown_request
+def release_pikpak_client(exc):
+    pooled = g.pop('pikpak_client', None)
+    if pooled is not None:
+        with _inflight_lock:
+            pooled.inflight -= 1
+
+# Offline task list paging used when matching a user's tasks
+TASK_PAGE_SIZE = 100
+TASK_MAX_PAGES = 5
+# Every phase, so finished downloads are still found (pikpakapi defaults to running/error only)
+TASK_PHASES = ['PHASE_TYPE_RUNNING', 'PHASE_TYPE_PENDING', 'PHASE_TYPE_ERROR', 'PHASE_TYPE_COMPLETE']
+
+# Short-lived cache for the listings the UI polls, keyed by (kind, ...)
+_api_cache = TTLCache(maxsize=512, ttl=3)
+_pending_calls = {}
+_MISSING = object()
+_cache_lock = threading.Lock()
+
+async def cached_call(key, make_coro):
+    """Return a recent result for key, sharing one in-flight PikPak call between concurrent callers"""
+    with _cache_lock:
+        # One lookup: TTLCache can expire an entry between `in` and the read
+        cached = _api_cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        task = _pending_calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make_coro())
+            _pending_calls[key] = task
+
+            def store(done):
+                with _cache_lock:
+                    # Skip if the key was invalidated while the call was running
+                    if _pending_calls.get(key) is done:
+                        del _pending_calls[key]
+                        if not done.cancelled() and done.exception() is None:
+                            _api_cache[key] = done.result()
+
+            task.add_done_callback(store)
+    return await asyncio.shield(task)
+
+def invalidate_cache(*kinds, user_id=None):
+    """Drop cached entries of the given kinds, optionally only for one user"""
+    with _cache_lock:
+        for store in (_api_cache, _pending_calls):
+            for key in list(store):
+                if key[0] in kinds and (user_id is None or key[1] == user_id):
+                    store.pop(key, None)
+
+STREAM_JSON_BATCH = 100
+
+def stream_json(result, list_key):
+    """Stream result as JSON, serializing the list under list_key in batches"""
+    def generate():
+        head = {k: v for k, v in result.items() if k != list_key}
+        yield orjson.dumps(head)[:-1] + (b',' if head else b'') + orjson.dumps(list_key) + b':['
+        entries = result.get(list_key) or []
+        for i in range(0, len(entries), STREAM_JSON_BATCH):
+            batch = b','.join(orjson.dumps(e) for e in entries[i:i + STREAM_JSON_BATCH])
+            yield (b',' if i else b'') + batch
+        yield b']}'
+
+    return Response(generate(), mimetype='application/json')
+
+# Recently loaded users, so polling requests skip the DB lookup.
+# Flask-Login already keeps the user on g for the rest of the request.
+_user_cache = TTLCache(maxsize=1024, ttl=60)
+_user_cache_lock = threading.Lock()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    with _user_cache_lock:
+        user = _user_cache.get(user_id)
+    if user is None:
+        user = User.query.get(user_id)
+        if user is not None:
+            # Detach so commits in later requests can't expire the cached attributes
+            db.session.expunge(user)
+            with _user_cache_lock:
+                _user_cache[user_id] = user
+    return user
+
+def forget_user(user_id):
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
 
 # Create tables
 with app.app_context():
     db.create_all()
+    # create_all skips existing tables, so add newer indexes to older databases
+    for index in Task.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+# New tasks are written behind the request in batches; until a task's row is
+# committed it is tracked in _pending_tasks (PikPak task ID -> user ID)
+TASK_FLUSH_INTERVAL = 0.05
+TASK_FLUSH_BATCH = 100
+# A batch that fails to commit is requeued this many times, then saved row by row
+TASK_WRITE_RETRIES = 3
+TASK_RETRY_BACKOFF = 0.5
+_task_queue = queue.SimpleQueue()
+_pending_tasks = {}
+_pending_lock = threading.Lock()
+# IDs in the batch currently being committed, and those deleted meanwhile
+_flushing_tasks = set()
+_deleted_while_flushing = set()
+_task_attempts = {}
+
+def queue_task(task):
+    with _pending_lock:
+        _pending_tasks[task.pikpak_task_id] = task.user_id
+    _task_queue.put(task)
+
+def pending_task_ids(user_id):
+    with _pending_lock:
+        return {task_id for task_id, owner in _pending_tasks.items() if owner == user_id}
+
+def discard_pending_task(task_id):
+    """Drop a task that has not been written yet; returns False if it is already in the DB"""
+    with _pending_lock:
+        if task_id in _flushing_tasks:
+            # The writer is committing it now and removes the row afterwards
+            _deleted_while_flushing.add(task_id)
+        return _pending_tasks.pop(task_id, None) is not None
+
+def _commit_tasks(rows):
+    """Insert (user_id, pikpak_task_id, name) rows in one transaction; returns success"""
+    try:
+        db.session.add_all(Task(user_id=u, pikpak_task_id=t, name=n) for u, t, n in rows)
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Failed to save {len(rows)} task(s): {e}")
+        return False
+
+def _requeue_tasks(rows):
+    for u, t, n in rows:
+        _task_queue.put(Task(user_id=u, pikpak_task_id=t, name=n))
+
+def _write_tasks(batch, final=False):
+    # The lock is only held around bookkeeping, never across the commit
+    with _pending_lock:
+        # Tasks deleted while queued are skipped
+        rows = [(t.user_id, t.pikpak_task_id, t.name) for t in batch if t.pikpak_task_id in _pending_tasks]
+        task_ids = [t for _, t, _ in rows]
+        _flushing_tasks.update(task_ids)
+        attempt = max((_task_attempts.get(t, 0) for t in task_ids), default=0) + 1
+    if not rows:
+        return
+
+    with app.app_context():
+        retry = []
+        if _commit_tasks(rows):
+            saved = task_ids
+        elif attempt < TASK_WRITE_RETRIES and not final:
+            saved, retry = [], rows
+        else:
+            # Last resort: one row at a time so a single bad row can't sink the rest
+            saved = [row[1] for row in rows if _commit_tasks([row])]
+
+        with _pending_lock:
+            deleted = _deleted_while_flushing.intersection(saved)
+            _deleted_while_flushing.difference_update(task_ids)
+            _flushing_tasks.difference_update(task_ids)
+            # Retried tasks stay pending (and visible to their owner) until they are saved
+            retry = [row for row in retry if row[1] in _pending_tasks]
+            for _, task_id, _ in retry:
+                _task_attempts[task_id] = attempt
+            done = set(task_ids) - {row[1] for row in retry}
+            lost = len(done.difference(saved).intersection(_pending_tasks))
+            for task_id in done:
+                _pending_tasks.pop(task_id, None)
+                _task_attempts.pop(task_id, None)
+
+        if lost:
+            logging.error(f"Giving up on {lost} task(s) after {attempt} attempt(s)")
+        if retry:
+            timer = threading.Timer(TASK_RETRY_BACKOFF * 2 ** (attempt - 1), _requeue_tasks, args=(retry,))
+            # Non-daemon, so the interpreter waits for a pending retry before the atexit hook stops the writer
+            timer.daemon = False
+            timer.start()
+
+        if deleted:
+            try:
+                Task.query.filter(Task.pikpak_task_id.in_(deleted)).delete(synchronize_session=False)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Failed to remove {len(deleted)} deleted task(s): {e}")
+
+_STOP_WRITER = object()
+
+def _task_writer():
+    stopping = False
+    while not stopping:
+        batch = []
+        item = _task_queue.get()
+        if item is _STOP_WRITER:
+            stopping = True
+        else:
+            batch.append(item)
+        deadline = time.monotonic() + TASK_FLUSH_INTERVAL
+        while not stopping and len(batch) < TASK_FLUSH_BATCH:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = _task_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP_WRITER:
+                stopping = True
+            else:
+                batch.append(item)
+        if batch:
+            _write_tasks(batch, final=stopping)
+
+    # Anything queued behind the stop marker is written before exiting
+    leftover = []
+    while not _task_queue.empty():
+        item = _task_queue.get_nowait()
+        if item is not _STOP_WRITER:
+            leftover.append(item)
+    if leftover:
+        _write_tasks(leftover, final=True)
+
+_task_writer_thread = threading.Thread(target=_task_writer, name='task-writer', daemon=True)
+_task_writer_thread.start()
+
+@atexit.register
+def _stop_task_writer():
+    # Let the writer finish the batch it holds and drain the queue, then wait for it
+    _task_queue.put(_STOP_WRITER)
+    _task_writer_thread.join(timeout=10)
 
 # ================= Auth =================
 
+# Argon2id for new hashes; older Werkzeug hashes are upgraded on next login
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+
+def verify_password(user, password):
+    """Check a password against the user's stored hash, rehashing it if outdated"""
+    stored = user.password_hash
+    if stored.startswith('$argon2'):
+        try:
+            password_hasher.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        needs_rehash = password_hasher.check_needs_rehash(stored)
+    else:
+        if not check_password_hash(stored, password):
+            return False
+        needs_rehash = True
+
+    if needs_rehash:
+        user.password_hash = password_hasher.hash(password)
+        db.session.commit()
+        forget_user(user.id)
+    return True
+
 @app.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -104,7 +557,7 @@ def register():
     except Exception as e:
         return jsonify({'error': f'Failed to create user storage: {str(e)}'}), 500
 
-    hashed_pw = generate_password_hash(password)
+    hashed_pw = password_hasher.hash(password)
     new_user = User(username=username, password_hash=hashed_pw, pikpak_folder_id=folder_id)
     db.session.add(new_user)
     db.session.commit()
@@ -119,7 +572,7 @@ def login():
     
     user = User.query.filter_by(username=username).first()
     
-    if user and check_password_hash(user.password_hash, password):
+    if user and password and verify_password(user, password):
         login_user(user)
         return jsonify({'success': True, 'user': {'username': user.username, 'id': user.id}})
     
@@ -153,16 +606,24 @@ def list_files():
     page_token = request.args.get('page_token')
 
     try:
-        result = run_async(client.file_list(
-            parent_id=target_folder,
-            next_page_token=page_token
+        result = run_async(cached_call(
+            ('files', current_user.id, target_folder, page_token),
+            lambda: client.file_list(parent_id=target_folder, next_page_token=page_token)
         ))
-        return jsonify(result)
+        return stream_json(result, 'files')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ================= Downloads =================
 
+def user_owns_task(user_id, task_id):
+    """Single EXISTS query instead of loading the Task row"""
+    with _pending_lock:
+        if _pending_tasks.get(task_id) == user_id:
+            return True
+    query = Task.query.filter_by(pikpak_task_id=task_id, user_id=user_id)
+    return db.session.query(query.exists()).scalar()
+
 @app.route('/api/download', methods=['POST'])
 @login_required
 def add_download():
@@ -185,10 +646,10 @@ def add_download():
         # Note: PikPak task ID is in result['task']['id'] usually
         task_id = result.get('task', {}).get('id')
         if task_id:
-            new_task = Task(user_id=current_user.id, pikpak_task_id=task_id, name="New Download")
-            db.session.add(new_task)
-            db.session.commit()
-            
+            queue_task(Task(user_id=current_user.id, pikpak_task_id=task_id, name="New Download"))
+
+        invalidate_cache('tasks')
+        invalidate_cache('files', user_id=current_user.id)
         return jsonify({'success': True, 'task': result})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -201,27 +662,35 @@ def list_tasks():
     # Or just rely on what we stored in DB?
     # Better: Query tasks from DB for this user, then fetch status for them.
     
-    user_tasks = Task.query.filter_by(user_id=current_user.id).all()
-    if not user_tasks:
+    user_task_ids = {row.pikpak_task_id for row in
+                     Task.query.with_entities(Task.pikpak_task_id).filter_by(user_id=current_user.id)}
+    user_task_ids |= pending_task_ids(current_user.id)
+    if not user_task_ids:
         return jsonify({'tasks': []})
 
-    # Optimization: Maybe filtering efficiently?
-    # PikPak `offline_list` returns mixed tasks. 
-    # We might just call offline_list and filter by our known task IDs from DB.
-    
+    # PikPak `offline_list` returns every task on the shared account and has no
+    # lookup by ID, so page through it and stop as soon as all of ours are found.
     try:
-        # Fetch mostly recent
-        pikpak_tasks = run_async(client.offline_list(limit=100)) 
-        # Match with user tasks
-        user_task_ids = {t.pikpak_task_id for t in user_tasks}
-        
         filtered_tasks = []
-        if 'tasks' in pikpak_tasks:
-            for t in pikpak_tasks['tasks']:
+        page_token = None
+        for _ in range(TASK_MAX_PAGES):
+            pikpak_tasks = run_async(cached_call(
+                ('tasks', page_token),
+                lambda token=page_token: client.offline_list(
+                    size=TASK_PAGE_SIZE, next_page_token=token, phase=TASK_PHASES
+                )
+            ))
+            for t in pikpak_tasks.get('tasks', []):
                 if t['id'] in user_task_ids:
+                    user_task_ids.discard(t['id'])
                     filtered_tasks.append(t)
-        
-        return jsonify({'tasks': filtered_tasks, 'next_page_token': pikpak_tasks.get('next_page_token')})
+                    if not user_task_ids:
+                        break
+            page_token = pikpak_tasks.get('next_page_token')
+            if not user_task_ids or not page_token:
+                break
+
+        return stream_json({'tasks': filtered_tasks, 'next_page_token': page_token}, 'tasks')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -236,17 +705,22 @@ def delete_task(task_id):
     # Verify ownership
     # We query by PikPak task ID (which is passed in URL usually, or our DB ID?)
     # The frontend usually passes the PikPak ID.
-    task = Task.query.filter_by(pikpak_task_id=task_id, user_id=current_user.id).first()
-    if not task:
+    if not user_owns_task(current_user.id, task_id):
         return jsonify({'error': 'Task not found or access denied'}), 404
 
     try:
         run_async(client.delete_tasks(task_ids=[task_id], delete_files=delete_files))
         
-        # Remove from DB
-        db.session.delete(task)
-        db.session.commit()
-        
+        # Remove from DB (or from the write-behind queue if it hasn't been saved yet)
+        if not discard_pending_task(task_id):
+            Task.query.filter_by(pikpak_task_id=task_id, user_id=current_user.id).delete(synchronize_session=False)
+            db.session.commit()
+
+        invalidate_cache('tasks')
+        if delete_files:
+            invalidate_cache('quota')
+            invalidate_cache('files', user_id=current_user.id)
+
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -256,12 +730,12 @@ def delete_task(task_id):
 def retry_task(task_id):
     client = get_pikpak_client()
     
-    task = Task.query.filter_by(pikpak_task_id=task_id, user_id=current_user.id).first()
-    if not task:
+    if not user_owns_task(current_user.id, task_id):
         return jsonify({'error': 'Task not found or access denied'}), 404
 
     try:
         result = run_async(client.offline_task_retry(task_id=task_id))
+        invalidate_cache('tasks')
         return jsonify({'success': True, 'task': result})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -291,25 +765,63 @@ def get_download_url(file_id):
 def proxy_download(file_id):
     client = get_pikpak_client()
     try:
-        file_info = run_async(client.offline_file_info(file_id=file_id))
-        download_data = run_async(client.get_download_url(file_id=file_id))
+        # Both lookups are independent, so let them overlap on the shared loop
+        file_info, download_data = run_async(gather(
+            client.offline_file_info(file_id=file_id),
+            client.get_download_url(file_id=file_id)
+        ))
         
-        url = download_data.get('web_content_link') or \
-              (download_data.get('medias') and download_data['medias'][0].get('link', {}).get('url')) or \
-              (download_data.get('links') and list(download_data['links'].values())[0].get('url'))
+        url = next((u for get_url in _DOWNLOAD_URL_ACCESSORS if (u := get_url(download_data))), None)
         
         if not url:
             return jsonify({'error': 'Download URL not found'}), 404
             
-        import requests
-        req = requests.get(url, stream=True)
+        # Pass the client's Range through so interrupted downloads can resume;
+        # otherwise probe large files with a first-segment Range request
+        client_range = request.headers.get('Range')
+        parallel = not client_range and int(file_info.get('size') or 0) >= PROXY_PARALLEL_MIN_SIZE
+        if client_range:
+            upstream_headers = {'Range': client_range}
+        elif parallel:
+            upstream_headers = {'Range': f'bytes=0-{PROXY_SEGMENT_SIZE - 1}'}
+        else:
+            upstream_headers = {}
+
+        req = _HTTP.send(_HTTP.build_request('GET', url, headers=upstream_headers), stream=True)
+
+        def generate():
+            # Relay the raw stream in large blocks; closing hands the connection back to the pool
+            try:
+                yield from req.iter_raw(PROXY_CHUNK_SIZE)
+            finally:
+                req.close()
+
+        headers = {
+            'Content-Disposition': f'attachment; filename="{file_info.get("name", "download")}"',
+            'Content-Type': file_info.get('mime_type', 'application/octet-stream'),
+            'Content-Length': file_info.get('size', req.headers.get('Content-Length'))
+        }
+        for name in ('Accept-Ranges', 'ETag', 'Last-Modified'):
+            if name in req.headers:
+                headers[name] = req.headers[name]
+
+        status = 200
+        if parallel and req.status_code == 206:
+            total = req.headers.get('Content-Range', '').rpartition('/')[2]
+            total = int(total) if total.isdigit() else int(file_info['size'])
+            body = _iter_segments(url, req, total)
+            headers['Content-Length'] = str(total)
+        else:
+            body = generate()
+            if req.status_code == 206:
+                status = 206
+                headers['Content-Length'] = req.headers.get('Content-Length')
+                headers['Content-Range'] = req.headers.get('Content-Range')
+
         return Response(
-            stream_with_context(req.iter_content(chunk_size=1024*1024)),
-            headers={
-                'Content-Disposition': f'attachment; filename="{file_info.get("name", "download")}"',
-                'Content-Type': file_info.get('mime_type', 'application/octet-stream'),
-                'Content-Length': file_info.get('size', req.headers.get('Content-Length'))
-            }
+            stream_with_context(body),
+            status=status,
+            headers={k: v for k, v in headers.items() if v is not None}
         )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -324,6 +836,8 @@ def trash_files():
     
     try:
         result = run_async(client.delete_to_trash(ids=file_ids))
+        invalidate_cache('quota')
+        invalidate_cache('files', user_id=current_user.id)
         return jsonify({'success': True, 'result': result})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -333,7 +847,7 @@ def trash_files():
 def get_quota():
     client = get_pikpak_client()
     try:
-        result = run_async(client.get_quota_info())
+        result = run_async(cached_call(('quota',), client.get_quota_info))
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
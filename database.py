@@ -1,9 +1,24 @@
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
 
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    # WAL lets readers run alongside the writer and avoids an fsync on every commit
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.close()
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -15,9 +30,11 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
 
 class Task(db.Model):
+    __table_args__ = (db.Index('ix_task_user_pikpak', 'user_id', 'pikpak_task_id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    pikpak_task_id = db.Column(db.String(100), nullable=False)
+    pikpak_task_id = db.Column(db.String(100), nullable=False, index=True)
     name = db.Column(db.String(200), nullable=True)
     status = db.Column(db.String(50), default='pending')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)